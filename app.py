@@ -1,11 +1,19 @@
-import dash
 import dash_leaflet as dl
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output
+from dash import ctx, no_update, Patch
+from dash.dependencies import ClientsideFunction
+from dash_extensions.enrich import (DashProxy, Input, Output, RedisBackend,
+                                    Serverside, ServersideOutputTransform,
+                                    State)
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
+import pyarrow as pa
+import pyarrow.compute as pc
 from influxdb_client import InfluxDBClient
 from datetime import datetime, timezone
+import functools
 import time
 import os
 
@@ -22,6 +30,35 @@ INFLUX_BUCKET = "ls300-tracking-demo"
 MEASUREMENT = "tracker_data"
 START_TIME = "2025-06-04T06:17:00Z"  # Adjust as needed
 
+# Local baseline cache so worker restarts don't re-pull the full history
+CACHE_FILE = os.environ.get("DATA_CACHE_FILE", "data_cache.parquet")
+# Sliding window (hours) to cap memory; 0 disables trimming
+DATA_WINDOW_HOURS = float(os.environ.get("DATA_WINDOW_HOURS", "0"))
+
+# Downsample in InfluxDB rather than shipping every raw sample over HTTP
+AGGREGATE_EVERY = os.environ.get("AGGREGATE_EVERY", "10s")
+# Polyline simplification tolerance in degrees; 0 disables it
+SIMPLIFY_TOLERANCE_DEG = float(os.environ.get("SIMPLIFY_TOLERANCE_DEG", "0.0001"))
+# TTL for the Flux query result cache; 0 disables caching
+QUERY_CACHE_SECONDS = int(os.environ.get("QUERY_CACHE_SECONDS", "25"))
+
+# Sensor channels kept as float32: marker display needs nowhere near float64
+# precision, and halving the element size halves frame memory
+FLOAT_FIELDS = ["latitude", "longitude", "temperature", "humidity", "speed",
+                "altitude", "pressure", "batteryVoltage"]
+
+# When set, the ingestion buffer and serverside session state live in Redis
+# so gunicorn workers share one copy instead of each holding the full frame
+REDIS_URL = os.environ.get("REDIS_URL")
+CHUNKS_KEY = "ls300:chunks"
+LAST_TIME_KEY = "ls300:last_time"
+
+if REDIS_URL:
+    import redis
+    redis_client = redis.Redis.from_url(REDIS_URL)
+else:
+    redis_client = None
+
 # -------------------------
 # Connect to InfluxDB
 # -------------------------
@@ -32,31 +69,281 @@ query_api = client.query_api()
 # Load all data
 # -------------------------
 
-def load_all_data():
+def _execute_query(query):
+    """Execute a Flux query, streaming result frames as they arrive.
+
+    query_data_frame_stream yields a frame per result chunk, so parsing
+    overlaps the network transfer instead of blocking until the whole
+    response has downloaded.
+    """
+    frames = [f for f in query_api.query_data_frame_stream(query) if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True)
+
+
+@functools.lru_cache(maxsize=32)
+def _cached_query(query, bucket):
+    return _execute_query(query)
+
+
+def run_query(query):
+    """Run a Flux query, with a short-TTL result cache.
+
+    Identical queries issued within the same QUERY_CACHE_SECONDS bucket
+    (e.g. several clients ticking between data arrivals) share one HTTP
+    round trip to InfluxDB.
+    """
+    if QUERY_CACHE_SECONDS <= 0:
+        return _execute_query(query)
+    bucket = int(time.time() // QUERY_CACHE_SECONDS)
+    return _cached_query(query, bucket)
+
+
+def concat_frames(frames):
+    """pd.concat that keeps the device column categorical.
+
+    Concatenating categoricals with different category sets silently decays
+    to object dtype; unify the categories first so groupby keeps working on
+    integer codes.
+    """
+    categorical = [f for f in frames
+                   if isinstance(f.get("device"), pd.Series)
+                   and isinstance(f["device"].dtype, pd.CategoricalDtype)]
+    if len(categorical) == len(frames) and frames:
+        categories = union_categoricals([f["device"] for f in frames]).categories
+        frames = [f.assign(device=f["device"].cat.set_categories(categories))
+                  for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def compact_dtypes(df):
+    """Downcast sensor floats to float32 and device names to category."""
+    float_cols = [c for c in FLOAT_FIELDS if c in df.columns]
+    for col in float_cols:
+        df[col] = pd.to_numeric(df[col], downcast="float")
+    if "device" in df.columns:
+        df["device"] = df["device"].astype("category")
+    return df
+
+
+def query_range(start):
     query = f'''
     from(bucket: "{INFLUX_BUCKET}")
-      |> range(start: {START_TIME})
+      |> range(start: {start})
       |> filter(fn: (r) => r._measurement == "{MEASUREMENT}")
-      |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-      |> keep(columns: ["_time", "device", "latitude", "longitude", "temperature", "humidity", "speed", "altitude", "pressure", "batteryVoltage", "counter", "heading", "hoursUptime", "satId", "userButton", "hall"])
+      |> aggregateWindow(every: {AGGREGATE_EVERY}, fn: last, createEmpty: false)
+      |> keep(columns: ["_time", "_field", "_value", "device"])
     '''
-    df = query_api.query_data_frame(query)
-
-    # Handle case when multiple DataFrames are returned
-    if isinstance(df, list):
-        df = pd.concat(df, ignore_index=True)
+    df = run_query(query)
 
     # Sometimes empty queries return metadata-only frames
     if df.empty or '_time' not in df.columns:
-        print("Warning: No data returned from InfluxDB or missing '_time' column.")
         return pd.DataFrame()  # return empty DataFrame to avoid crash later
 
-    df = df.rename(columns={"_time": "time"})
-    df["time"] = pd.to_datetime(df["time"])
+    # Pivot the long (time, device, field, value) rows to one column per
+    # field here rather than in Flux: a single vectorized pandas call, and
+    # the InfluxDB response stays smaller on the wire.
+    df = df.pivot_table(index=["_time", "device"], columns="_field",
+                        values="_value", aggfunc="last").reset_index()
+    df.columns.name = None
+    # Rename in place rather than paying for a full-frame copy, and let
+    # to_datetime's parse cache collapse repeated identical timestamps
+    df.rename(columns={"_time": "time"}, inplace=True)
+    df["time"] = pd.to_datetime(df["time"], utc=True, cache=True)
+    return compact_dtypes(df)
+
+
+def simplify_path(coords, tolerance=SIMPLIFY_TOLERANCE_DEG):
+    """Douglas-Peucker path simplification (iterative, perpendicular distance).
+
+    Drops intermediate points that deviate less than `tolerance` degrees from
+    the line between their neighbours, so long straight stretches collapse to
+    their endpoints before being sent to the browser.
+    """
+    if tolerance <= 0 or len(coords) < 3:
+        return coords
+    pts = np.asarray(coords, dtype=float)
+    keep = np.zeros(len(pts), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(pts) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end <= start + 1:
+            continue
+        rel = pts[start + 1:end] - pts[start]
+        d = pts[end] - pts[start]
+        norm = np.hypot(d[0], d[1])
+        if norm == 0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(d[0] * rel[:, 1] - d[1] * rel[:, 0]) / norm
+        furthest = int(np.argmax(dist))
+        if dist[furthest] > tolerance:
+            idx = start + 1 + furthest
+            keep[idx] = True
+            stack.append((start, idx))
+            stack.append((idx, end))
+    return pts[keep].tolist()
+
+
+def trim_window(df):
+    """Drop rows older than DATA_WINDOW_HOURS to cap memory (0 = keep all)."""
+    if DATA_WINDOW_HOURS > 0 and not df.empty:
+        cutoff = df["time"].max() - pd.Timedelta(hours=DATA_WINDOW_HOURS)
+        df = df[df["time"] >= cutoff]
+    return df
+
+
+def load_all_data():
+    # Warm start: read the cached baseline and only query Influx for the tail
+    baseline = pd.DataFrame()
+    if os.path.exists(CACHE_FILE):
+        try:
+            baseline = compact_dtypes(pd.read_parquet(CACHE_FILE))
+        except Exception as e:
+            print(f"Warning: could not read {CACHE_FILE}: {e}")
+
+    if baseline.empty:
+        df = query_range(START_TIME)
+    else:
+        start = f'time(v: "{baseline["time"].max().isoformat()}")'
+        tail = query_range(start)
+        df = concat_frames([baseline, tail]) if not tail.empty else baseline
+        df.drop_duplicates(subset=["device", "time"], inplace=True)
+
+    if df.empty:
+        print("Warning: No data returned from InfluxDB or missing '_time' column.")
+        return df
+
+    df = trim_window(df)
+    try:
+        df.to_parquet(CACHE_FILE)
+    except Exception as e:
+        print(f"Warning: could not write {CACHE_FILE}: {e}")
     return df
 
-# Global data store
+# Global data store: a list of Arrow tables appended per tick, combined
+# lazily. Appending chunks is O(new rows); a single growing concat would be
+# O(N) per tick (O(N^2) overall). Arrow's concat_tables is zero-copy for
+# compatible chunked arrays, unlike pd.concat which copies every column
+# buffer into a new BlockManager.
+#
+# With REDIS_URL set the buffer lives in Redis as Arrow IPC payloads, so all
+# gunicorn workers share one copy; otherwise it is per-process module state.
+CHUNK_COLLAPSE_THRESHOLD = 32
+
+
+def chunk_max_time(table):
+    return pc.max(table.column("time")).as_py()
+
+
+def concat_chunks(tables):
+    if len(tables) == 1:
+        return tables[0]
+    return pa.concat_tables(tables, promote_options="default")
+
+
+def table_to_ipc(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def table_from_ipc(buf):
+    return pa.ipc.open_stream(buf).read_all()
+
+
+def load_chunks():
+    if redis_client is not None:
+        return [table_from_ipc(b) for b in redis_client.lrange(CHUNKS_KEY, 0, -1)]
+    return data_chunks
+
+
+def append_chunk(table, max_time):
+    """Append a delta chunk and advance the ingestion watermark."""
+    global last_time
+    if redis_client is not None:
+        pipe = redis_client.pipeline()
+        pipe.rpush(CHUNKS_KEY, table_to_ipc(table))
+        pipe.set(LAST_TIME_KEY, max_time.isoformat())
+        pipe.execute()
+    else:
+        data_chunks.append(table)
+        last_time = max_time
+
+
+def replace_chunks(table):
+    """Collapse the buffer back to a single chunk."""
+    global data_chunks
+    if redis_client is not None:
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(CHUNKS_KEY)
+        pipe.rpush(CHUNKS_KEY, table_to_ipc(table))
+        pipe.execute()
+    else:
+        data_chunks = [table]
+
+
+def get_last_time():
+    # The watermark is maintained incrementally so the callback doesn't
+    # recompute an O(N) max() over the whole frame every tick
+    if redis_client is not None:
+        raw = redis_client.get(LAST_TIME_KEY)
+        return pd.Timestamp(raw.decode()) if raw else None
+    return last_time
+
+
 data_df = load_all_data()
+data_chunks = []
+last_time = None
+if not data_df.empty:
+    baseline_table = pa.Table.from_pandas(data_df, preserve_index=False)
+    baseline_time = data_df["time"].max()
+    if redis_client is not None:
+        # First worker to boot seeds the shared buffer; the rest skip
+        if redis_client.set(LAST_TIME_KEY, baseline_time.isoformat(), nx=True):
+            redis_client.rpush(CHUNKS_KEY, table_to_ipc(baseline_table))
+    else:
+        data_chunks = [baseline_table]
+        last_time = baseline_time
+
+
+def combined_frame():
+    """Concatenate the chunk buffer into one frame for rendering.
+
+    Collapses the buffer back to a single frame once it grows past
+    CHUNK_COLLAPSE_THRESHOLD so the lazy concat stays cheap.
+    """
+    chunks = load_chunks()
+    if not chunks:
+        return pd.DataFrame()
+    df = concat_chunks(chunks).to_pandas()
+    if len(chunks) > 1:
+        df.drop_duplicates(subset=["device", "time"], inplace=True)
+        df.sort_values(by=["device", "time"], inplace=True)
+        df = trim_window(df)
+    if len(chunks) > CHUNK_COLLAPSE_THRESHOLD:
+        replace_chunks(pa.Table.from_pandas(df, preserve_index=False))
+    return df
+
+
+def rows_since(ts):
+    """Rows newer than `ts` from the chunk buffer.
+
+    Only touches chunks whose max timestamp is past `ts`, so a session
+    catching up on a few ticks doesn't rescan the whole history.
+    """
+    recent = [c for c in load_chunks() if chunk_max_time(c) > ts]
+    if not recent:
+        return pd.DataFrame()
+    df = concat_chunks(recent).to_pandas()
+    df = df[df["time"] > ts]
+    df = df.drop_duplicates(subset=["device", "time"])
+    return df.sort_values("time")
 
 # Assign a unique color per device
 device_colors = {}
@@ -65,7 +352,15 @@ color_palette = ["red", "blue", "green", "purple", "yellow", "orange", "pink", "
 # -------------------------
 # Create Dash App
 # -------------------------
-app = dash.Dash(__name__)
+# Session state shares the Redis instance when configured, so any worker can
+# serve any session; the default file-system backend only works single-host
+if redis_client is not None:
+    serverside_transform = ServersideOutputTransform(
+        backends=[RedisBackend(host=redis_client)])
+else:
+    serverside_transform = ServersideOutputTransform()
+
+app = DashProxy(__name__, transforms=[serverside_transform])
 app.title = "LS300 Tracker Demo"
 server = app.server
 
@@ -130,120 +425,188 @@ app.layout = html.Div(
         ),
         dl.Map(center=map_center, zoom=12, id="live-map", style={'width': '100%', 'height': 'calc(100vh - 120px)'}, children=[
             dl.TileLayer(),
-            dl.LayerGroup(id="marker-layer")
+            dl.LayerGroup(id="marker-layer"),
+            dl.LayerGroup(id="line-layer")
         ]),
-        dcc.Interval(id="interval", interval=30*1000, n_intervals=0)
+        dcc.Store(id="data-store"),
+        # Per-session render state; held server-side via Serverside so the
+        # browser only ever receives a reference token
+        dcc.Store(id="render-state"),
+        dcc.Interval(id="interval", interval=30*1000, n_intervals=0),
+        # Slow reconciliation tick: forces a full rebuild to pick up anything
+        # the delta patches missed (dedupe, re-simplified polylines)
+        dcc.Interval(id="full-refresh", interval=600*1000, n_intervals=0)
     ]
 )
 
 # -------------------------
-# Helper to format hover popup
+# Marker / line builders
 # -------------------------
-def format_popup(row):
-    return html.Div([
-        html.B(f"Device: {row['device']}"),
-        html.Br(),
-        f"Time: {row['time'].strftime('%Y-%m-%d %H:%M:%S')}",
-        html.Br(),
-        f"Lat: {row.get('latitude', 'N/A')}°",
-        html.Br(),
-        f"Lon: {row.get('longitude', 'N/A')}°",
-        html.Br(),
-        f"Temp: {row.get('temperature', 'N/A')}°C",
-        html.Br(),
-        f"Humidity: {row.get('humidity', 'N/A')}%",
-        html.Br(),
-        f"Speed: {row.get('speed', 'N/A')} m/s",
-        html.Br(),
-        f"Pressure: {row.get('pressure', 'N/A')} hPa",
-        html.Br(),
-        f"Battery: {row.get('batteryVoltage', 'N/A')} V",
-        html.Br(),
-        f"Uptime: {row.get('hoursUptime', 'N/A')} h"
-    ])
+# Columns shipped to the browser; the hover popup is rendered client-side
+# (assets/render_markers.js) so the server never builds per-row HTML trees.
+POPUP_FIELDS = ["device", "time", "latitude", "longitude", "temperature",
+                "humidity", "speed", "pressure", "batteryVoltage", "hoursUptime"]
+
+
+def assign_colors(df):
+    """Assign palette colours to unseen devices and attach a color column."""
+    # Assign colors only to new devices
+    for device in df["device"].dropna().unique():
+        if device not in device_colors:
+            # Assign next available colour (loop if more devices than colours)
+            device_colors[device] = color_palette[len(device_colors) % len(color_palette)]
+    # One vectorized map instead of a dict lookup per record in the hot loop
+    return df.assign(color=df["device"].map(device_colors).fillna("black"))
+
+
+def drop_invalid_coords(df):
+    """Filter rows without a usable position with one vectorized mask.
+
+    Done once per frame so neither the marker nor the polyline path needs
+    per-row NaN checks.
+    """
+    valid = df[["latitude", "longitude"]].notna().all(axis=1)
+    return df.loc[valid]
+
+
+# Finished records cached by (device, time): a historical row's payload
+# never changes, so full refreshes reuse it instead of re-formatting it
+record_cache = {}
+RECORD_CACHE_MAX = 100_000
+
+
+def build_records(df):
+    # A single to_dict("records") conversion is one C-level pass, rather
+    # than iterrows allocating a Series per row. Rows without coordinates
+    # have already been dropped by drop_invalid_coords.
+    if len(record_cache) > RECORD_CACHE_MAX:
+        record_cache.clear()
+    cols = [c for c in POPUP_FIELDS if c in df.columns] + ["color"]
+    records = []
+    for row in df[cols].to_dict(orient="records"):
+        key = (row.get("device"), row["time"].value)
+        record = record_cache.get(key)
+        if record is None:
+            row["time"] = row["time"].strftime('%Y-%m-%d %H:%M:%S')
+            record_cache[key] = record = row
+        records.append(record)
+    return records
+
+
+def build_lines(df, device_index):
+    """Build one polyline per device, recording each device's child index in
+    `device_index` so delta updates can extend its positions in place."""
+    lines = []
+    df = df.sort_values(["device", "time"])  # one sort; groups stay time-ordered
+    for device, group in df.groupby("device", sort=False, observed=True):
+        # Single C-level conversion instead of a Python zip over two Series
+        coords = simplify_path(group[["latitude", "longitude"]].to_numpy().tolist())
+        color = device_colors.get(device, "black")  # fallback
+
+        device_index[device] = len(lines)
+        lines.append(
+            dl.Polyline(
+                positions=coords,
+                color=color,
+                weight=4,
+                dashArray="5, 5",  # "on, off" pattern for dashes
+                opacity=0.6
+            )
+        )
+    return lines
 
 # -------------------------
 # Callback to update map
 # -------------------------
-@app.callback(
+# Render CircleMarkers + tooltips in the browser from the compact record
+# store; keeps per-row HTML generation off the server entirely.
+app.clientside_callback(
+    ClientsideFunction(namespace="tracker", function_name="render_markers"),
     Output("marker-layer", "children"),
-    Input("interval", "n_intervals")
+    Input("data-store", "data")
+)
+
+
+@app.callback(
+    Output("data-store", "data"),
+    Output("line-layer", "children"),
+    Output("render-state", "data"),
+    Input("interval", "n_intervals"),
+    Input("full-refresh", "n_intervals"),
+    State("render-state", "data")
 )
-def update_map(n):
-    global data_df
+def update_map(n, full_n, render_state):
     # Query new data
-    if data_df.empty or "time" not in data_df.columns:
-        return []
+    watermark = get_last_time()
+    if watermark is None:
+        return [], [], no_update
 
-    try:
-        last_time = data_df["time"].max().isoformat()
-    except Exception as e:
-        print(f"Error extracting last_time: {e}")
-        return []
-    query = f'''
-    from(bucket: "{INFLUX_BUCKET}")
-      |> range(start: time(v: "{last_time}"))
-      |> filter(fn: (r) => r._measurement == "{MEASUREMENT}")
-      |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-      |> keep(columns: ["_time", "device", "latitude", "longitude", "temperature", "humidity", "speed", "altitude", "pressure", "batteryVoltage", "counter", "heading", "hoursUptime", "satId", "userButton", "hall"])
-    '''
-    new_df = query_api.query_data_frame(query)
+    new_df = query_range(f'time(v: "{watermark.isoformat()}")')
+    if not new_df.empty:
+        # The Flux range start is inclusive, so every tick re-returns the
+        # rows sitting exactly on the watermark; drop them before they can
+        # enter the buffer as duplicates
+        new_df = new_df[new_df["time"] > watermark]
     if not new_df.empty:
-        new_df = new_df.rename(columns={"_time": "time"})
-        new_df["time"] = pd.to_datetime(new_df["time"])
-        data_df = pd.concat([data_df, new_df], ignore_index=True)
-        data_df.drop_duplicates(subset=["device", "time"], inplace=True)
-        data_df.sort_values(by=["device", "time"], inplace=True)
+        append_chunk(pa.Table.from_pandas(new_df, preserve_index=False),
+                     new_df["time"].max())
 
-    # Filter to only include devices starting with "satellite"
-    # To disable this filter, comment out the following line
-    data_df = data_df[data_df["device"].str.startswith("satellite")]
+    # Full render: on the session's first call, and on the slow
+    # reconciliation tick, send complete layers and record what the session
+    # has seen so the fast ticks in between can stay delta-only.
+    if render_state is None or ctx.triggered_id == "full-refresh":
+        data_df = combined_frame()
+        if data_df.empty:
+            return [], [], no_update
+        rendered_until = data_df["time"].max()
 
-    global device_colors  # ensure we’re modifying the global mapping
+        # Filter to only include devices starting with "satellite"
+        # To disable this filter, comment out the following line
+        data_df = data_df[data_df["device"].str.startswith("satellite")]
+        data_df = drop_invalid_coords(data_df)
 
-    # Assign colors only to new devices
-    for device in data_df["device"].dropna().unique():
-        if device not in device_colors:
-            device_colors[device] = color_palette[len(device_colors) % len(color_palette)]
+        data_df = assign_colors(data_df)
+        device_index = {}
+        lines = build_lines(data_df, device_index)
+        render_state = {"rendered_until": rendered_until, "device_index": device_index}
+        return build_records(data_df), lines, Serverside(render_state)
 
-    # Build markers
-    markers = []
-    for _, row in data_df.iterrows():
-        device = row.get("device", "unknown")
-        if device not in device_colors:
-            # Assign next available colour (loop if more devices than colours)
-            device_colors[device] = color_palette[len(device_colors) % len(color_palette)]
+    # Delta path: patch in only the rows this session hasn't drawn yet
+    # instead of re-serializing every marker and polyline.
+    delta = rows_since(render_state["rendered_until"])
+    if not delta.empty:
+        rendered_until = delta["time"].max()
+        delta = delta[delta["device"].str.startswith("satellite")]
+        delta = drop_invalid_coords(delta)
+    if delta.empty:
+        return no_update, no_update, no_update
 
-        if pd.notna(row["latitude"]) and pd.notna(row["longitude"]):
-            markers.append(
-                dl.CircleMarker(
-                    center=(row["latitude"], row["longitude"]),
-                    radius=8,
-                    color=device_colors[device],
-                    fill=True,
-                    fillOpacity=0.2,
-                    children=dl.Tooltip(children=format_popup(row))
-                )
-            )
-    
-    # Build lines per device
-    lines = []
-    for device, group in data_df.groupby("device"):
-        group = group.sort_values("time")  # ensure ordered path
-        coords = list(zip(group["latitude"], group["longitude"]))
-        color = device_colors.get(device, "black")  # fallback
+    delta = assign_colors(delta)
+
+    record_patch = Patch()
+    for record in build_records(delta):
+        record_patch.append(record)
 
-        if len(coords) >= 2:
-            lines.append(
+    device_index = render_state["device_index"]
+    line_patch = Patch()
+    # delta is already time-sorted, so each group's path is in order
+    for device, group in delta.groupby("device", sort=False, observed=True):
+        coords = group[["latitude", "longitude"]].to_numpy().tolist()
+        if device in device_index:
+            line_patch[device_index[device]]["props"]["positions"].extend(coords)
+        else:
+            device_index[device] = len(device_index)
+            line_patch.append(
                 dl.Polyline(
                     positions=coords,
-                    color=color,
+                    color=device_colors.get(device, "black"),
                     weight=4,
-                    dashArray="5, 5",  # "on, off" pattern for dashes
+                    dashArray="5, 5",
                     opacity=0.6
                 )
             )
-    return markers + lines
+    render_state = {"rendered_until": rendered_until, "device_index": device_index}
+    return record_patch, line_patch, Serverside(render_state)
 
 # -------------------------
 # Run the app
@@ -0,0 +1,53 @@
+// Client-side marker rendering: builds CircleMarker + Tooltip components
+// from the compact records in data-store, so the server only ships data.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    tracker: {
+        render_markers: function (records) {
+            if (!records) {
+                return [];
+            }
+            const br = () => ({namespace: "dash_html_components", type: "Br", props: {}});
+            const fmt = (v) => (v === null || v === undefined) ? "N/A" : v;
+            return records.map(function (row) {
+                const popup = [
+                    {
+                        namespace: "dash_html_components",
+                        type: "B",
+                        props: {children: "Device: " + fmt(row.device)}
+                    },
+                    br(), "Time: " + fmt(row.time),
+                    br(), "Lat: " + fmt(row.latitude) + "°",
+                    br(), "Lon: " + fmt(row.longitude) + "°",
+                    br(), "Temp: " + fmt(row.temperature) + "°C",
+                    br(), "Humidity: " + fmt(row.humidity) + "%",
+                    br(), "Speed: " + fmt(row.speed) + " m/s",
+                    br(), "Pressure: " + fmt(row.pressure) + " hPa",
+                    br(), "Battery: " + fmt(row.batteryVoltage) + " V",
+                    br(), "Uptime: " + fmt(row.hoursUptime) + " h"
+                ];
+                return {
+                    namespace: "dash_leaflet",
+                    type: "CircleMarker",
+                    props: {
+                        center: [row.latitude, row.longitude],
+                        radius: 8,
+                        color: row.color,
+                        fill: true,
+                        fillOpacity: 0.2,
+                        children: {
+                            namespace: "dash_leaflet",
+                            type: "Tooltip",
+                            props: {
+                                children: {
+                                    namespace: "dash_html_components",
+                                    type: "Div",
+                                    props: {children: popup}
+                                }
+                            }
+                        }
+                    }
+                };
+            });
+        }
+    }
+});